@@ -16,9 +16,28 @@ class Settings(BaseSettings):
     # Gemini API
     gemini_api_key: str = os.getenv("GEMINI_API_KEY")
     gemini_model: str = "gemini-2.5-flash"
+    gemini_context_cache: bool = True  # Cache the static system prompt server-side
+    gemini_context_cache_ttl_seconds: int = 3600
     
     # MongoDB
     mongodb_uri: Optional[str] = os.getenv("MONGODB_URI")
+    mongo_max_pool_size: int = 100  # Upper bound on concurrent connections per worker
+    mongo_min_pool_size: int = 10  # Connections kept warm between bursts
+    
+    # Redis (optional - chat sessions fall back to process memory without it)
+    redis_url: Optional[str] = os.getenv("REDIS_URL")
+    
+    # Chat sessions
+    session_ttl_seconds: int = 3600  # Sliding expiry for idle sessions
+    session_max_messages: int = 20  # Messages kept per session
+    session_memory_max_sessions: int = 10_000  # Sessions kept in process memory without Redis
+    chat_history_token_budget: int = 2000  # Approximate tokens of history sent to Gemini
+    
+    # Sandboxes
+    view_flush_interval_seconds: int = 10  # How often buffered views are written to MongoDB
+    view_flush_key_ttl_seconds: int = 86400  # How long views of an interrupted flush can be recovered
+    sandbox_cache_ttl_seconds: int = 60  # How long a read sandbox is served from memory
+    sandbox_cache_size: int = 10_000  # Sandboxes kept in the per-worker read cache
     
     # CORS
     cors_origins: str = "http://localhost:3000,http://127.0.0.1:3000"
@@ -32,9 +51,14 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8000
     debug: bool = False
+    workers: int = 1  # >1 needs REDIS_URL so chat sessions are shared between workers
     
     # RAG Configuration
     rag_top_k: int = 3  # Number of documents to retrieve
+    rag_max_top_k: int = 10  # Upper bound on documents per retrieval
+    rag_exact_search_max_docs: int = 10_000  # Brute-force (exact) search up to this many docs
+    rag_cache_size: int = 512  # Recent queries whose retrieved context is kept
+    rag_preload: bool = False  # Load the persisted index at import (gunicorn --preload shares it)
     
     class Config:
         env_file = [".env", "../../.env", "../../../.env"]
@@ -191,18 +191,22 @@ COMPONENT_LIBRARY: list[ComponentCategory] = [
 ]
 
 
+# Lookup tables built once from the static library above
+_COMPONENTS_BY_ID: dict[str, ComponentDefinition] = {
+    component.id: component
+    for category in COMPONENT_LIBRARY
+    for component in category.components
+}
+_CATEGORIES_BY_ID: dict[str, ComponentCategory] = {
+    category.id: category for category in COMPONENT_LIBRARY
+}
+
+
 def get_component_by_id(component_id: str) -> Optional[ComponentDefinition]:
     """Get a component definition by its ID."""
-    for category in COMPONENT_LIBRARY:
-        for component in category.components:
-            if component.id == component_id:
-                return component
-    return None
+    return _COMPONENTS_BY_ID.get(component_id)
 
 
 def get_category_by_id(category_id: str) -> Optional[ComponentCategory]:
     """Get a category by its ID."""
-    for category in COMPONENT_LIBRARY:
-        if category.id == category_id:
-            return category
-    return None
+    return _CATEGORIES_BY_ID.get(category_id)
@@ -0,0 +1,56 @@
+"""
+One-off maintenance jobs for the sandboxes collection.
+
+Run from the backend directory:
+
+    python -m app.db.maintenance
+"""
+
+import asyncio
+from app.db.mongodb import MongoDB, get_sandboxes_collection
+
+# Server-side equivalent of routers.sandboxes.extract_tech_stack: the sorted,
+# de-duplicated, non-empty node labels. Needs MongoDB 5.2+ ($sortArray).
+TECH_STACK_UPDATE = [
+    {"$set": {"techStack": {"$sortArray": {
+        "input": {"$setUnion": [{"$filter": {
+            "input": {"$map": {
+                "input": {"$ifNull": ["$architectureJson.nodes", []]},
+                "in": "$$this.data.label",
+            }},
+            "cond": {"$and": [
+                {"$ne": ["$$this", None]},
+                {"$ne": ["$$this", ""]},
+            ]},
+        }}]},
+        "sortBy": 1,
+    }}}}
+]
+
+
+async def backfill_tech_stack() -> int:
+    """
+    Re-derive `techStack` from `architectureJson` for every sandbox.
+    
+    Runs as a single pipeline update inside MongoDB, so no documents travel
+    through the app. Use after component labels change.
+    
+    Returns:
+        Number of documents modified
+    """
+    result = await get_sandboxes_collection().update_many({}, TECH_STACK_UPDATE)
+    return result.modified_count
+
+
+async def main():
+    """Run all maintenance jobs."""
+    await MongoDB.connect()
+    try:
+        modified = await backfill_tech_stack()
+        print(f"✅ Re-derived techStack for {modified} sandboxes")
+    finally:
+        MongoDB.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
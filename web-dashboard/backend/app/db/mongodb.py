@@ -1,20 +1,35 @@
 """MongoDB connection manager using motor (async MongoDB driver)."""
 
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel
 from app.config import settings
 
+# Case-insensitive (strength 2) comparison, matching the projectName index
+CASE_INSENSITIVE_COLLATION = {"locale": "en", "strength": 2}
+
+
 class MongoDB:
     """MongoDB connection manager."""
     
     client: AsyncIOMotorClient = None
     
     @classmethod
-    def connect(cls):
-        """Initialize MongoDB connection."""
+    async def connect(cls):
+        """Initialize MongoDB connection on the running event loop."""
         if not settings.mongodb_uri:
             raise ValueError("MONGODB_URI environment variable is required")
         
-        cls.client = AsyncIOMotorClient(settings.mongodb_uri)
+        cls.client = AsyncIOMotorClient(
+            settings.mongodb_uri,
+            maxPoolSize=settings.mongo_max_pool_size,
+            minPoolSize=settings.mongo_min_pool_size,
+            maxIdleTimeMS=30_000,
+            waitQueueTimeoutMS=10_000,  # Fail instead of queueing forever on a saturated pool
+            serverSelectionTimeoutMS=5_000,
+            retryWrites=True,
+        )
+        # Fail fast on a bad URI and warm the pool before user traffic
+        await cls.client.admin.command("ping")
         print(f"✅ Connected to MongoDB")
     
     @classmethod
@@ -28,7 +43,7 @@ class MongoDB:
     def get_database(cls):
         """Get database instance."""
         if not cls.client:
-            cls.connect()
+            raise RuntimeError("MongoDB not initialized - connect() must run at startup")
         return cls.client.get_database("quota-sandbox")
     
     @classmethod
@@ -42,3 +57,23 @@ class MongoDB:
 def get_sandboxes_collection():
     """Get the sandboxes collection."""
     return MongoDB.get_collection("sandboxes")
+
+
+async def ensure_sandbox_indexes():
+    """Create the indexes the sandbox queries rely on (no-op if they exist)."""
+    collection = get_sandboxes_collection()
+    # Sandbox IDs are generated by the API; the index guarantees uniqueness
+    await collection.create_index("sandboxId", unique=True)
+    # Case-insensitive project name search
+    await collection.create_index(
+        [("projectName", 1)],
+        name="projectName_ci",
+        collation=CASE_INSENSITIVE_COLLATION,
+    )
+    # Explore listing: public filter + newest-first keyset sort served from the index,
+    # plus the optional tech stack (multikey) and cost range filters
+    await collection.create_indexes([
+        IndexModel([("isPublic", 1), ("createdAt", -1), ("_id", -1)]),
+        IndexModel([("techStack", 1)]),
+        IndexModel([("totalCost", 1)]),
+    ])
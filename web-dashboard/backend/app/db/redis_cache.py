@@ -0,0 +1,35 @@
+"""Redis connection manager using redis-py's asyncio client."""
+
+from typing import Optional
+from redis.asyncio import Redis
+from app.config import settings
+
+
+class RedisCache:
+    """Redis connection manager (optional - only used when REDIS_URL is set)."""
+    
+    client: Optional[Redis] = None
+    
+    @classmethod
+    async def connect(cls):
+        """Initialize Redis connection if configured."""
+        if not settings.redis_url:
+            print("ℹ️  REDIS_URL not set - chat sessions are kept in process memory")
+            return
+        
+        cls.client = Redis.from_url(settings.redis_url, decode_responses=True)
+        await cls.client.ping()
+        print("✅ Connected to Redis")
+    
+    @classmethod
+    async def close(cls):
+        """Close Redis connection."""
+        if cls.client:
+            await cls.client.aclose()
+            cls.client = None
+            print("🔌 Redis connection closed")
+    
+    @classmethod
+    def get_client(cls) -> Optional[Redis]:
+        """Get the Redis client, or None when Redis is not configured."""
+        return cls.client
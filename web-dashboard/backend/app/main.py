@@ -1,15 +1,30 @@
 """Main FastAPI application."""
 
+import asyncio
+from contextlib import suppress
+from typing import Optional
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.config import settings
 from app.routers import chat, sandboxes
-from app.db.mongodb import MongoDB
+from app.db.mongodb import MongoDB, ensure_sandbox_indexes
+from app.db.redis_cache import RedisCache
+from app.services.view_counter import view_counter
+from app.services.rag_service import get_rag_service, preload_rag_service
+
+# With gunicorn --preload this runs once in the master process, so forked
+# workers share the FAISS index pages copy-on-write instead of each loading one.
+# Only an index already on disk is loaded; no API client is created before fork.
+if settings.rag_preload and not preload_rag_service():
+    print("ℹ️  No persisted RAG index to preload - each worker builds it on startup")
 
 # Create FastAPI app
 app = FastAPI(
     title=settings.api_title,
     version=settings.api_version,
+    # orjson encodes the nested architecture payloads much faster than stdlib json
+    default_response_class=ORJSONResponse,
 )
 
 # Configure CORS
@@ -19,23 +34,53 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routers
 app.include_router(chat.router, prefix=settings.api_prefix)
 app.include_router(sandboxes.router, prefix=settings.api_prefix)
 
+# Background task writing buffered sandbox views to MongoDB
+view_flush_task: Optional[asyncio.Task] = None
+# Background task building the RAG index (see warm_rag_service)
+rag_warmup_task: Optional[asyncio.Task] = None
+
+
+async def warm_rag_service():
+    """Build the RAG service in a worker thread so the first chat doesn't wait for it."""
+    try:
+        await asyncio.to_thread(get_rag_service)
+    except Exception as e:
+        # The first chat request retries the build
+        print(f"⚠️ RAG warm-up failed: {str(e)}")
+
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize MongoDB connection on startup."""
-    MongoDB.connect()
+    """Initialize MongoDB and Redis connections on startup."""
+    global view_flush_task, rag_warmup_task
+    await MongoDB.connect()
+    await ensure_sandbox_indexes()
+    await RedisCache.connect()
+    view_flush_task = asyncio.create_task(view_counter.run())
+    rag_warmup_task = asyncio.create_task(warm_rag_service())
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close MongoDB connection on shutdown."""
+    """Close MongoDB and Redis connections on shutdown."""
+    if view_flush_task:
+        view_flush_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await view_flush_task
+    # Write out views counted since the last flush
+    try:
+        await view_counter.flush()
+    except Exception as e:
+        print(f"⚠️ Failed to flush sandbox views: {str(e)}")
     MongoDB.close()
+    await RedisCache.close()
 
 
 @app.get("/")
@@ -60,5 +105,10 @@ if __name__ == "__main__":
         "app.main:app",
         host=settings.host,
         port=settings.port,
-        reload=settings.debug
+        reload=settings.debug,
+        # reload mode only supports a single process
+        workers=1 if settings.debug else settings.workers,
+        # libuv event loop + C HTTP parser (both ship with uvicorn[standard])
+        loop="uvloop",
+        http="httptools"
     )
@@ -51,4 +51,4 @@ class SandboxFilters(BaseModel):
     minCost: Optional[float] = None
     maxCost: Optional[float] = None
     limit: int = Field(default=20, ge=1, le=100)
-    skip: int = Field(default=0, ge=0)
+    cursor: Optional[str] = None
@@ -1,41 +1,32 @@
 """Chat API router."""
 
-import uuid
-import re
 import json
+import asyncio
+import hashlib
+import orjson
 from typing import Dict, List, Optional
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from app.models.chat import ChatRequest, ChatResponse, ImplementRequest, ImplementResponse
-from app.services.gemini_service import GeminiService
-from app.services.rag_service import RAGService
+from app.services.gemini_service import GeminiService, get_gemini_service
+from app.services.rag_service import RAGService, get_rag_service
 from app.services.architecture_service import ArchitectureService
+from app.services.session_service import SessionService
+from app.services.singleflight import SingleFlight
+from app.data.components_data import get_component_by_id
 from app.config import settings
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-# In-memory session storage (can be migrated to Redis later)
-sessions: Dict[str, List[Dict[str, str]]] = {}
+# Fenced ```json block emitted by Gemini (scope analysis / mentioned components)
+_JSON_FENCE = "```json"
+
+# Coalesces identical Gemini requests that arrive while one is already in flight
+_gemini_inflight = SingleFlight()
 
 # Initialize services (singleton pattern)
-gemini_service: GeminiService | None = None
-rag_service: RAGService | None = None
 architecture_service: ArchitectureService | None = None
-
-
-def get_gemini_service() -> GeminiService:
-    """Get or create Gemini service instance."""
-    global gemini_service
-    if gemini_service is None:
-        gemini_service = GeminiService()
-    return gemini_service
-
-
-def get_rag_service() -> RAGService:
-    """Get or create RAG service instance."""
-    global rag_service
-    if rag_service is None:
-        rag_service = RAGService()
-    return rag_service
+session_service: SessionService | None = None
 
 
 def get_architecture_service() -> ArchitectureService:
@@ -46,45 +37,210 @@ def get_architecture_service() -> ArchitectureService:
     return architecture_service
 
 
-def get_or_create_session(session_id: Optional[str]) -> str:
-    """Get existing session or create a new one."""
-    if session_id and session_id in sessions:
-        return session_id
-    new_session_id = str(uuid.uuid4())
-    sessions[new_session_id] = []
-    return new_session_id
+def get_session_service() -> SessionService:
+    """Get or create session service instance."""
+    global session_service
+    if session_service is None:
+        session_service = SessionService()
+    return session_service
+
+
+# Intent keywords by category. A keyword may belong to several categories.
+_INTENT_KEYWORDS: Dict[str, tuple[str, ...]] = {
+    # Direct canvas/diagram mentions
+    "direct": ("canvas", "diagram", "visualize", "visualization", "draw", "sure", "show"),
+    # Architecture-related keywords
+    "architecture": ("architecture", "system", "stack", "setup", "infrastructure"),
+    # Action words
+    "action": ("create", "design", "build", "make", "show", "implement", "set up", "add", "sure"),
+    # General implementation keywords (for backward compatibility)
+    "implementation": ("implement", "create", "build", "design", "set up", "add"),
+}
+
+
+def scan_intent_keywords(message: str) -> set[str]:
+    """Return the keyword categories mentioned in a message, lowercasing it once."""
+    message_lower = message.lower()
+    return {
+        category
+        for category, keywords in _INTENT_KEYWORDS.items()
+        if any(keyword in message_lower for keyword in keywords)
+    }
 
 
-def detect_canvas_intent(message: str) -> bool:
+def detect_canvas_intent(message: str, hits: Optional[set[str]] = None) -> bool:
     """
     Detect if the user wants to implement something on the canvas.
     
     Very flexible detection - triggers on:
     1. Any mention of "canvas", "diagram", "visualize"
     2. Architecture-related words + action words (create, design, build, show, etc.)
+    
+    Pass `hits` from scan_intent_keywords() to reuse an existing scan.
     """
-    message_lower = message.lower()
+    if hits is None:
+        hits = scan_intent_keywords(message)
     
-    # Direct canvas/diagram mentions
-    direct_triggers = ["canvas", "diagram", "visualize", "visualization", "draw", "sure","show"]
-    if any(trigger in message_lower for trigger in direct_triggers):
+    if "direct" in hits:
         return True
     
-    # Architecture-related keywords
-    architecture_terms = ["architecture", "system", "stack", "setup", "infrastructure"]
+    # Check if message contains both architecture term and action word
+    return "architecture" in hits and "action" in hits
+
+
+def _gemini_request_key(
+    request: ChatRequest,
+    context: str,
+    conversation_history: List[Dict[str, str]]
+) -> str:
+    """Hash everything that goes into a Gemini prompt, for request coalescing."""
+    payload = json.dumps(
+        [
+            request.message,
+            context,
+            conversation_history,
+            request.chat_width,
+            request.architecture_json.scope.model_dump(),
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _extract_json_blocks(text: str, keys: tuple[str, ...]) -> tuple[dict, str]:
+    """
+    Pull every fenced ```json object block carrying one of `keys` out of a response.
     
-    # Action words
-    action_words = ["create", "design", "build", "make", "show", "implement", "set up", "add", "sure"]
+    Each block body runs to the next fence and is parsed with orjson in one
+    call, so the text is scanned once instead of matched with a lazy regex and
+    then parsed again. Gemini may emit scope_analysis and mentioned_components
+    in separate blocks, so the keys of all matching blocks are merged. Other
+    JSON blocks (e.g. an example the user asked for) are left in place.
+    
+    Returns:
+        The merged objects and the text with the matching blocks removed
+    """
+    merged: dict = {}
+    kept: list[str] = []
+    pos = 0
+    start = text.find(_JSON_FENCE)
+    while start != -1:
+        body_start = start + len(_JSON_FENCE)
+        close = text.find("```", body_start)
+        if close == -1:
+            break
+        try:
+            data = orjson.loads(text[body_start:close])
+        except orjson.JSONDecodeError:
+            data = None
+        if isinstance(data, dict) and any(key in data for key in keys):
+            merged.update(data)
+            kept.append(text[pos:start])
+            pos = close + 3
+        start = text.find(_JSON_FENCE, close + 3)
+    kept.append(text[pos:])
+    return merged, "".join(kept)
+
+
+def build_chat_response(
+    request: ChatRequest,
+    session_id: str,
+    response_text: str,
+    gemini: GeminiService,
+    arch_service: ArchitectureService
+) -> ChatResponse:
+    """
+    Turn a complete Gemini reply into a ChatResponse.
+    
+    Strips the hidden JSON blocks, applies scope updates and generates the
+    canvas architecture when the user asked for one.
+    """
+    # Parse the structured JSON blocks (scope analysis + mentioned components)
+    # once, so everything comes out of the single Gemini response
+    updated_scope = None
+    structured_components: Optional[List[str]] = None
+    try:
+        data, stripped_text = _extract_json_blocks(
+            response_text, ("scope_analysis", "mentioned_components")
+        )
+        if "scope_analysis" in data:
+            analysis = data["scope_analysis"]
+            # Map to Scope fields (removing estimatedCost as it's not in Scope model directly, or handling it separately)
+            # The Scope model has: users, trafficLevel, dataVolumeGB, regions, availability
+            updated_scope = {
+                "users": analysis.get("users"),
+                "trafficLevel": analysis.get("trafficLevel"),
+                "dataVolumeGB": analysis.get("dataVolumeGB"),
+                "regions": analysis.get("regions"),
+                "availability": analysis.get("availability")
+            }
+            # Filter out None values
+            updated_scope = {k: v for k, v in updated_scope.items() if v is not None}
+            print(f"📊 Detected scope update: {updated_scope}")
+        if isinstance(data.get("mentioned_components"), list):
+            # Keep only IDs that exist in the component library
+            structured_components = [
+                cid for cid in dict.fromkeys(data["mentioned_components"])
+                if isinstance(cid, str) and get_component_by_id(cid)
+            ]
+        if data:
+            # Remove the JSON blocks from the visible response
+            response_text = stripped_text.strip()
+    except Exception as e:
+        print(f"⚠️ Failed to parse scope JSON: {str(e)}")
+    
+    # Detect canvas implementation intent (one keyword scan serves both checks)
+    intent_hits = scan_intent_keywords(request.message)
+    canvas_intent = detect_canvas_intent(request.message, intent_hits)
+    canvas_action = "none"
+    updated_architecture = None
+    
+    # Only generate architecture if canvas intent AND components are mentioned
+    # This prevents generation when AI is just asking questions
+    if canvas_intent:
+        # Prefer the component IDs Gemini listed in the JSON block; fall back to
+        # scanning the user message and AI response for older-style replies, or
+        # when none of the listed IDs are in the component library
+        if structured_components:
+            mentioned_components = structured_components
+        else:
+            mentioned_components = gemini.extract_component_ids_from_text(
+                request.message + " " + response_text
+            )
+    
+        # Only generate if we found actual components (not just intent keywords)
+        if mentioned_components and len(mentioned_components) > 0:
+            # Generate architecture from mentioned components
+            updated_architecture = arch_service.generate_architecture_from_components(
+                component_ids=mentioned_components,
+                scope=request.architecture_json.scope
+            )
+            canvas_action = "update"
+            print(f"🎨 Generating canvas with components: {mentioned_components}")
+        else:
+            print("💬 Canvas intent detected but no components mentioned - likely clarifying questions")
+            canvas_action = "none"
     
-    # Check if message contains both architecture term and action word
-    has_architecture = any(term in message_lower for term in architecture_terms)
-    has_action = any(action in message_lower for action in action_words)
     
-    return has_architecture and has_action
+    # Check for general implementation keywords (for backward compatibility)
+    suggest_implementation = "implementation" in intent_hits
+    
+    return ChatResponse(
+        message=response_text,
+        session_id=session_id,
+        suggest_implementation=suggest_implementation,
+        updated_architecture=updated_architecture,
+        canvas_action=canvas_action,
+        updated_scope=updated_scope
+    )
 
 
 @router.post("", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(
+    request: ChatRequest,
+    gemini: GeminiService = Depends(get_gemini_service),
+    rag: RAGService = Depends(get_rag_service)
+):
     """
     Handle chat messages with RAG context and canvas implementation detection.
     
@@ -94,112 +250,42 @@ async def chat(request: ChatRequest):
     """
     try:
         # Get or create session
-        session_id = get_or_create_session(request.session_id)
-        session_history = sessions[session_id]
+        session_store = get_session_service()
+        session_id = await session_store.get_or_create(request.session_id)
         
         # Get services
-        rag = get_rag_service()
-        gemini = get_gemini_service()
         arch_service = get_architecture_service()
         
-        # Retrieve relevant context from RAG (no API call - just vector search)
-        context = rag.retrieve_context(request.message)
+        # Retrieve relevant context from RAG. A new query costs an embedding API
+        # call, so it runs in a worker thread instead of blocking the event loop
+        context = await asyncio.to_thread(rag.retrieve_context, request.message)
         
         # Get conversation history
-        conversation_history = session_history[-10:]  # Last 10 messages
-        
-        # Prepare scope for context-aware recommendations
-        scope_dict = {
-            "users": request.architecture_json.scope.users,
-            "trafficLevel": request.architecture_json.scope.trafficLevel,
-            "dataVolumeGB": request.architecture_json.scope.dataVolumeGB,
-            "regions": request.architecture_json.scope.regions,
-            "availability": request.architecture_json.scope.availability,
-        }
+        conversation_history = await session_store.get_recent_history(session_id)
         
-        # Generate response - SINGLE Gemini API call per request
-        response_text = gemini.generate_response(
-            user_message=request.message,
-            context=context,
-            conversation_history=conversation_history if conversation_history else None,
-            chat_width=request.chat_width,
-            scope=scope_dict
+        # Generate response - SINGLE Gemini API call per request, shared with any
+        # identical request already in flight
+        response_text = await _gemini_inflight.do(
+            _gemini_request_key(request, context, conversation_history),
+            lambda: gemini.generate_response(
+                user_message=request.message,
+                context=context,
+                conversation_history=conversation_history if conversation_history else None,
+                chat_width=request.chat_width,
+                scope=request.architecture_json.scope
+            )
         )
         
         # Add messages to session history
-        session_history.append({"role": "user", "content": request.message})
-        session_history.append({"role": "assistant", "content": response_text})
-        
-        # Detect canvas implementation intent
-        canvas_intent = detect_canvas_intent(request.message)
-        canvas_action = "none"
-        updated_architecture = None
-        
-        # Only generate architecture if canvas intent AND components are mentioned
-        # This prevents generation when AI is just asking questions
-        if canvas_intent:
-            # Extract component IDs mentioned in the user message and AI response
-            mentioned_components = gemini.extract_component_ids_from_text(
-                request.message + " " + response_text
-            )
-            
-            # Only generate if we found actual components (not just intent keywords)
-            if mentioned_components and len(mentioned_components) > 0:
-                # Generate architecture from mentioned components
-                updated_architecture = arch_service.generate_architecture_from_components(
-                    component_ids=mentioned_components,
-                    scope=request.architecture_json.scope
-                )
-                canvas_action = "update"
-                print(f"🎨 Generating canvas with components: {mentioned_components}")
-            else:
-                print("💬 Canvas intent detected but no components mentioned - likely clarifying questions")
-                canvas_action = "none"
-        
-        # Extract scope analysis if present
-        updated_scope = None
-        try:
-            # Look for JSON block with scope_analysis
-            json_match = re.search(r"```json\s*(\{.*?\})\s*```", response_text, re.DOTALL)
-            if json_match:
-                data = json.loads(json_match.group(1))
-                if "scope_analysis" in data:
-                    analysis = data["scope_analysis"]
-                    # Map to Scope fields (removing estimatedCost as it's not in Scope model directly, or handling it separately)
-                    # The Scope model has: users, trafficLevel, dataVolumeGB, regions, availability
-                    updated_scope = {
-                        "users": analysis.get("users"),
-                        "trafficLevel": analysis.get("trafficLevel"),
-                        "dataVolumeGB": analysis.get("dataVolumeGB"),
-                        "regions": analysis.get("regions"),
-                        "availability": analysis.get("availability")
-                    }
-                    # Filter out None values
-                    updated_scope = {k: v for k, v in updated_scope.items() if v is not None}
-                    print(f"📊 Detected scope update: {updated_scope}")
-                    
-                    # Remove the JSON block from the visible response
-                    response_text = response_text.replace(json_match.group(0), "").strip()
-        except Exception as e:
-            print(f"⚠️ Failed to parse scope JSON: {str(e)}")
-        
-        
-        # Check for general implementation keywords (for backward compatibility)
-        suggest_implementation = any(
-            keyword in request.message.lower()
-            for keyword in ["implement", "create", "build", "design", "set up", "add"]
+        await session_store.append(
+            session_id,
+            {"role": "user", "content": request.message},
+            {"role": "assistant", "content": response_text},
         )
         
-        response = ChatResponse(
-            message=response_text,
-            session_id=session_id,
-            suggest_implementation=suggest_implementation,
-            updated_architecture=updated_architecture,
-            canvas_action=canvas_action,
-            updated_scope=updated_scope
+        return build_chat_response(
+            request, session_id, response_text, gemini, arch_service
         )
-        
-        return response
     
     except Exception as e:
         import traceback
@@ -207,8 +293,80 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
 
+@router.post("/stream")
+async def chat_stream(
+    request: ChatRequest,
+    gemini: GeminiService = Depends(get_gemini_service),
+    rag: RAGService = Depends(get_rag_service)
+):
+    """
+    Stream a chat response as server-sent events.
+    
+    Emits `data: {"token": ...}` frames while Gemini generates, then a final
+    `event: done` frame whose data is the full ChatResponse (with the JSON block
+    stripped and any scope/canvas updates applied). Clients should replace the
+    streamed text with `message` from the done frame. Failures after streaming
+    has started are reported as an `event: error` frame.
+    """
+    try:
+        # Get or create session
+        session_store = get_session_service()
+        session_id = await session_store.get_or_create(request.session_id)
+        
+        # Get services
+        arch_service = get_architecture_service()
+        
+        # Retrieve relevant context from RAG (off the event loop, as in chat)
+        context = await asyncio.to_thread(rag.retrieve_context, request.message)
+        
+        # Get conversation history
+        conversation_history = await session_store.get_recent_history(session_id)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
+    
+    async def event_stream():
+        parts: List[str] = []
+        try:
+            async for token in gemini.stream_response(
+                user_message=request.message,
+                context=context,
+                conversation_history=conversation_history if conversation_history else None,
+                chat_width=request.chat_width,
+                scope=request.architecture_json.scope
+            ):
+                parts.append(token)
+                yield f"data: {json.dumps({'token': token})}\n\n"
+            
+            response_text = "".join(parts)
+            
+            # Add messages to session history
+            await session_store.append(
+                session_id,
+                {"role": "user", "content": request.message},
+                {"role": "assistant", "content": response_text},
+            )
+            
+            response = build_chat_response(
+                request, session_id, response_text, gemini, arch_service
+            )
+            yield f"event: done\ndata: {response.model_dump_json()}\n\n"
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            detail = json.dumps({"detail": f"Error processing chat: {str(e)}"})
+            yield f"event: error\ndata: {detail}\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @router.post("/implement", response_model=ImplementResponse)
-async def implement_architecture(request: ImplementRequest):
+async def implement_architecture(
+    request: ImplementRequest,
+    gemini: GeminiService = Depends(get_gemini_service),
+    rag: RAGService = Depends(get_rag_service)
+):
     """
     Implement architecture changes based on user request.
     
@@ -216,15 +374,14 @@ async def implement_architecture(request: ImplementRequest):
     architecture JSON accordingly.
     """
     try:
-        session_id = get_or_create_session(request.session_id)
+        session_id = await get_session_service().get_or_create(request.session_id)
         
         # Get services
-        rag = get_rag_service()
-        gemini = get_gemini_service()
         arch_service = get_architecture_service()
         
-        # Retrieve context about components and architectures (no API call - just vector search)
-        context = rag.retrieve_context(request.implementation_request)
+        # Retrieve context about components and architectures (off the event
+        # loop: a new query costs an embedding API call)
+        context = await asyncio.to_thread(rag.retrieve_context, request.implementation_request)
         
         # For now, return the architecture as-is
         # In production, this would use Gemini to parse the request and modify the architecture
@@ -245,15 +402,15 @@ async def implement_architecture(request: ImplementRequest):
 @router.get("/sessions/{session_id}")
 async def get_session(session_id: str):
     """Get conversation history for a session."""
-    if session_id not in sessions:
+    session_store = get_session_service()
+    if not await session_store.exists(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
-    return {"session_id": session_id, "messages": sessions[session_id]}
+    return {"session_id": session_id, "messages": await session_store.get_history(session_id)}
 
 
 @router.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
     """Delete a session."""
-    if session_id in sessions:
-        del sessions[session_id]
+    await get_session_service().delete(session_id)
     return {"message": "Session deleted"}
 
@@ -1,33 +1,96 @@
 """Sandboxes API router for publishing and retrieving shared sandboxes."""
 
+import base64
+import json
 import secrets
+import time
 from typing import List, Optional
+from cachetools import TTLCache
 from datetime import datetime
-from fastapi import APIRouter, HTTPException, Query
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, HTTPException, Query, Response
+from pymongo.errors import DuplicateKeyError
 from app.models.sandbox import (
     SandboxCreate,
     SandboxResponse,
     SandboxListItem,
     SandboxFilters
 )
-from app.db.mongodb import get_sandboxes_collection
+from app.config import settings
+from app.db.mongodb import get_sandboxes_collection, CASE_INSENSITIVE_COLLATION
+from app.services.view_counter import view_counter
 
 router = APIRouter(prefix="/sandboxes", tags=["sandboxes"])
 
+# Fields needed for SandboxListItem - skips the (large) architectureJson.
+# _id is kept as the pagination tiebreaker.
+LIST_PROJECTION = {
+    "sandboxId": 1,
+    "projectName": 1,
+    "description": 1,
+    "techStack": 1,
+    "totalCost": 1,
+    "createdAt": 1,
+    "views": 1,
+}
+
+
+# Recently read sandboxes by ID. Published sandboxes are never modified, so the
+# only moving part is `views`, which holds the stored count (see get_sandbox).
+_sandbox_cache: TTLCache = TTLCache(
+    maxsize=settings.sandbox_cache_size,
+    ttl=settings.sandbox_cache_ttl_seconds
+)
+
+
+def _bump_cached_views(flushed: dict[str, int]):
+    """Move views this worker just wrote to MongoDB into the cached stored counts."""
+    for sandbox_id, count in flushed.items():
+        cached = _sandbox_cache.get(sandbox_id)
+        if cached is not None:
+            cached.views += count
+
+
+view_counter.add_flush_listener(_bump_cached_views)
+
+# Crockford base32, lowercased; ascending in ASCII, so IDs sort by creation time
+_ID_ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+
 
 def generate_sandbox_id() -> str:
-    """Generate a unique sandbox ID (8 characters)."""
-    return secrets.token_urlsafe(6)[:8]
+    """
+    Generate a time-ordered sandbox ID (16 characters).
+    
+    ULID-style: a 48-bit millisecond timestamp followed by 32 random bits. Two IDs
+    can only collide when created in the same millisecond with the same random part.
+    """
+    value = (time.time_ns() // 1_000_000) << 32 | secrets.randbits(32)
+    return "".join(_ID_ALPHABET[(value >> shift) & 31] for shift in range(75, -1, -5))
+
+
+def encode_cursor(created_at: datetime, object_id: ObjectId) -> str:
+    """Encode the sort key of the last listed sandbox as an opaque cursor."""
+    payload = json.dumps([created_at.isoformat(), str(object_id)])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    """Decode a cursor from encode_cursor (400 if it is malformed)."""
+    try:
+        created_at, object_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), ObjectId(object_id)
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 def extract_tech_stack(architecture_json: dict) -> List[str]:
     """Extract unique tech stack from architecture nodes."""
-    tech_stack = set()
-    for node in architecture_json.get("nodes", []):
-        component_name = node.get("data", {}).get("label", "")
-        if component_name:
-            tech_stack.add(component_name)
-    return sorted(list(tech_stack))
+    return sorted({
+        component_name
+        for node in architecture_json.get("nodes", ())
+        if (component_name := node.get("data", {}).get("label"))
+    })
 
 
 @router.post("", response_model=SandboxResponse, status_code=201)
@@ -39,28 +102,17 @@ async def publish_sandbox(sandbox: SandboxCreate):
     """
     collection = get_sandboxes_collection()
     
-    # Generate unique ID
-    sandbox_id = generate_sandbox_id()
-    
-    # Ensure uniqueness (retry if collision)
-    max_retries = 5
-    for _ in range(max_retries):
-        existing = await collection.find_one({"sandboxId": sandbox_id})
-        if not existing:
-            break
-        sandbox_id = generate_sandbox_id()
-    else:
-        raise HTTPException(status_code=500, detail="Failed to generate unique ID")
-    
-    # Extract tech stack and calculate cost
-    arch_json = sandbox.architectureJson.model_dump()
+    # Extract tech stack and calculate cost. This is the only walk of the
+    # validated model; the response below echoes the model itself. Fields the
+    # client left unset are omitted and come back as their defaults when read;
+    # explicit values (nulls included) are stored as sent.
+    arch_json = sandbox.architectureJson.model_dump(exclude_unset=True)
     tech_stack = extract_tech_stack(arch_json)
-    total_cost = arch_json.get("costEstimate", {}).get("total", 0.0)
+    total_cost = (arch_json.get("costEstimate") or {}).get("total", 0.0)
     
     # Create document
     now = datetime.utcnow()
     document = {
-        "sandboxId": sandbox_id,
         "projectName": sandbox.projectName,
         "description": sandbox.description,
         "architectureJson": arch_json,
@@ -72,8 +124,14 @@ async def publish_sandbox(sandbox: SandboxCreate):
         "views": 0
     }
     
-    # Insert into MongoDB
-    result = await collection.insert_one(document)
+    # Insert into MongoDB with no pre-check; the unique sandboxId index still
+    # rejects the (vanishingly unlikely) collision
+    sandbox_id = generate_sandbox_id()
+    document["sandboxId"] = sandbox_id
+    try:
+        result = await collection.insert_one(document)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=500, detail="Failed to generate unique ID")
     
     if not result.inserted_id:
         raise HTTPException(status_code=500, detail="Failed to publish sandbox")
@@ -100,24 +158,26 @@ async def get_sandbox(sandbox_id: str):
     
     Increments view counter on each access.
     """
+    # Views are buffered and written in bulk, so report the stored count plus
+    # the views still waiting to be flushed
+    cached = _sandbox_cache.get(sandbox_id)
+    if cached is not None:
+        pending_views = await view_counter.incr(sandbox_id)
+        return cached.model_copy(update={"views": cached.views + pending_views})
+    
     collection = get_sandboxes_collection()
     
-    # Find sandbox
     sandbox = await collection.find_one({"sandboxId": sandbox_id})
     
     if not sandbox:
         raise HTTPException(status_code=404, detail="Sandbox not found")
     
-    # Increment view counter
-    await collection.update_one(
-        {"sandboxId": sandbox_id},
-        {"$inc": {"views": 1}}
-    )
+    pending_views = await view_counter.incr(sandbox_id)
     
     # Convert MongoDB document to response model
     from app.models.architecture import ArchitectureJson
     
-    return SandboxResponse(
+    response = SandboxResponse(
         sandboxId=sandbox["sandboxId"],
         projectName=sandbox["projectName"],
         description=sandbox.get("description"),
@@ -127,31 +187,45 @@ async def get_sandbox(sandbox_id: str):
         createdAt=sandbox["createdAt"],
         updatedAt=sandbox["updatedAt"],
         isPublic=sandbox["isPublic"],
-        views=sandbox["views"] + 1  # Return incremented value
+        views=sandbox["views"]
     )
+    _sandbox_cache[sandbox_id] = response
+    return response.model_copy(update={"views": response.views + pending_views})
 
 
 @router.get("", response_model=List[SandboxListItem])
 async def list_sandboxes(
-    search: Optional[str] = Query(None, description="Search by project name"),
+    response: Response,
+    search: Optional[str] = Query(
+        None, max_length=64, description="Search by project name prefix (case-insensitive)"
+    ),
     tech_stack: Optional[str] = Query(None, description="Filter by tech (comma-separated)"),
     min_cost: Optional[float] = Query(None, ge=0),
     max_cost: Optional[float] = Query(None, ge=0),
     limit: int = Query(20, ge=1, le=100),
-    skip: int = Query(0, ge=0)
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page")
 ):
     """
     List public sandboxes with optional filters.
     
-    Supports pagination, search, and filtering by tech stack and cost.
+    Supports search and filtering by tech stack and cost. Pagination is keyset
+    based: when more results may follow, the response carries an X-Next-Cursor
+    header to pass back as `cursor` for the next page.
     """
     collection = get_sandboxes_collection()
     
     # Build query
     query = {"isPublic": True}
     
+    # Collapse whitespace runs so stray spaces don't become part of the prefix;
+    # blank means no filter
+    search = " ".join(search.split()) if search else None
     if search:
-        query["projectName"] = {"$regex": search, "$options": "i"}
+        # Case-insensitive prefix match, expressed as a range so it can use the
+        # collation index ($regex is not collation-aware). U+FFFF sorts after
+        # every other character under ICU collation. The bound is compared
+        # literally, so characters like "*" or "." are never patterns.
+        query["projectName"] = {"$gte": search, "$lt": search + "\uffff"}
     
     if tech_stack:
         tech_list = [t.strip() for t in tech_stack.split(",")]
@@ -165,9 +239,24 @@ async def list_sandboxes(
             cost_query["$lte"] = max_cost
         query["totalCost"] = cost_query
     
+    # Keyset pagination: resume strictly after the last (createdAt, _id) seen
+    if cursor:
+        after_created_at, after_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"createdAt": {"$lt": after_created_at}},
+            {"createdAt": after_created_at, "_id": {"$lt": after_id}},
+        ]
+    
     # Execute query with pagination
-    cursor = collection.find(query).sort("createdAt", -1).skip(skip).limit(limit)
-    sandboxes = await cursor.to_list(length=limit)
+    db_cursor = collection.find(query, projection=LIST_PROJECTION)
+    if search:
+        db_cursor = db_cursor.collation(CASE_INSENSITIVE_COLLATION)
+    db_cursor = db_cursor.sort([("createdAt", -1), ("_id", -1)]).limit(limit)
+    sandboxes = await db_cursor.to_list(length=limit)
+    
+    if len(sandboxes) == limit:
+        last = sandboxes[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["createdAt"], last["_id"])
     
     # Convert to response models
     return [
@@ -2,13 +2,21 @@
 
 import uuid
 import random
-from typing import Optional, List
+from typing import Optional, List, Dict
 from app.models.architecture import ArchitectureJson, ArchitectureNode, Edge, Scope
 from app.data.components_data import get_component_by_id, COMPONENT_LIBRARY
 from app.services.connection_validator import validate_connection
 from app.services.cost_calculator import calculate_costs
 
 
+# Category of every component, so node creation is a dict lookup
+_COMPONENT_TO_CATEGORY = {
+    component.id: category
+    for category in COMPONENT_LIBRARY
+    for component in category.components
+}
+
+
 class ArchitectureService:
     """Service for architecture manipulation and generation."""
     
@@ -36,12 +44,7 @@ class ArchitectureService:
             return None
         
         # Find category for this component
-        category = None
-        for cat in COMPONENT_LIBRARY:
-            if any(c.id == component_id for c in cat.components):
-                category = cat
-                break
-        
+        category = _COMPONENT_TO_CATEGORY.get(component_id)
         if not category:
             return None
         
@@ -122,8 +125,12 @@ class ArchitectureService:
         Returns:
             Updated architecture
         """
-        architecture.nodes = [n for n in architecture.nodes if n.id != node_id]
-        architecture.edges = [
+        # Node ids are unique, so drop the single match in place
+        for index, node in enumerate(architecture.nodes):
+            if node.id == node_id:
+                del architecture.nodes[index]
+                break
+        architecture.edges[:] = [
             e for e in architecture.edges
             if e.source != node_id and e.target != node_id
         ]
@@ -188,11 +195,7 @@ class ArchitectureService:
                 continue
                 
             # Find category
-            category = None
-            for cat in COMPONENT_LIBRARY:
-                if any(c.id == comp_id for c in cat.components):
-                    category = cat.id
-                    break
+            category = _COMPONENT_TO_CATEGORY[comp_id].id
             
             if category not in nodes_by_category:
                 nodes_by_category[category] = []
@@ -233,16 +236,11 @@ class ArchitectureService:
                     if cat not in nodes_by_category:
                         nodes_by_category[cat] = []
         
-        # Helper to get nodes by category
-        def get_nodes_by_category(cat: str):
-            return [n for n in architecture.nodes if n.data.category == cat]
-        
-        # Helper to find node by id
-        def get_node_by_id(node_id: str):
-            for node in architecture.nodes:
-                if node.id == node_id:
-                    return node
-            return None
+        # Index created nodes once; the connection rules below only read these
+        nodes_in_category: Dict[str, List[ArchitectureNode]] = {}
+        for node in architecture.nodes:
+            nodes_in_category.setdefault(node.data.category, []).append(node)
+        nodes_by_id = {node.id: node for node in architecture.nodes}
         
         # Create smart connections
         edges_created = set()  # Track to avoid duplicates
@@ -258,8 +256,8 @@ class ArchitectureService:
                 return  # Already exists
             
             # Get node positions
-            source_node = get_node_by_id(source_id)
-            target_node = get_node_by_id(target_id)
+            source_node = nodes_by_id.get(source_id)
+            target_node = nodes_by_id.get(target_id)
             
             if not source_node or not target_node:
                 return
@@ -304,98 +302,82 @@ class ArchitectureService:
             ))
             edges_created.add(edge_key)
         
+        def connect_all(
+            source_category: str,
+            target_category: str,
+            target_keywords: Optional[List[str]] = None
+        ):
+            """Connect every node of one category to every node of another."""
+            targets = nodes_in_category.get(target_category, [])
+            if target_keywords:
+                targets = [
+                    t for t in targets
+                    if any(keyword in t.data.componentId for keyword in target_keywords)
+                ]
+            for source in nodes_in_category.get(source_category, []):
+                for target in targets:
+                    add_edge(source.id, target.id)
+        
         # Frontend -> Backend
-        for frontend in get_nodes_by_category("frontend"):
-            for backend in get_nodes_by_category("backend"):
-                add_edge(frontend.id, backend.id)
+        connect_all("frontend", "backend")
         
         # Backend -> Database
-        for backend in get_nodes_by_category("backend"):
-            for db in get_nodes_by_category("database"):
-                add_edge(backend.id, db.id)
+        connect_all("backend", "database")
         
         # Database -> Cache (cache population/invalidation logic often flows this way conceptually or via CDC)
-        for db in get_nodes_by_category("database"):
-            for cache in get_nodes_by_category("cache"):
-                add_edge(db.id, cache.id)
+        connect_all("database", "cache")
         
         # Backend -> Cache
-        for backend in get_nodes_by_category("backend"):
-            for cache in get_nodes_by_category("cache"):
-                add_edge(backend.id, cache.id)
+        connect_all("backend", "cache")
         
         # Backend -> Queue
-        for backend in get_nodes_by_category("backend"):
-            for queue in get_nodes_by_category("queue"):
+        for backend in nodes_in_category.get("backend", []):
+            for queue in nodes_in_category.get("queue", []):
                 add_edge(backend.id, queue.id)
                 # Queue -> Backend (worker/consumer pattern)
                 add_edge(queue.id, backend.id)
         
         # Backend -> Auth
-        for backend in get_nodes_by_category("backend"):
-            for auth in get_nodes_by_category("auth"):
-                add_edge(backend.id, auth.id)
+        connect_all("backend", "auth")
         
         # Auth -> Database
-        for auth in get_nodes_by_category("auth"):
-            for db in get_nodes_by_category("database"):
-                add_edge(auth.id, db.id)
+        connect_all("auth", "database")
         
         # Backend -> Storage
-        for backend in get_nodes_by_category("backend"):
-            for storage in get_nodes_by_category("storage"):
-                add_edge(backend.id, storage.id)
+        connect_all("backend", "storage")
         
         # Backend -> ML
-        for backend in get_nodes_by_category("backend"):
-            for ml in get_nodes_by_category("ml"):
-                add_edge(backend.id, ml.id)
+        connect_all("backend", "ml")
         
         # ML -> Storage (model artifacts, datasets)
-        for ml in get_nodes_by_category("ml"):
-            for storage in get_nodes_by_category("storage"):
-                add_edge(ml.id, storage.id)
+        connect_all("ml", "storage")
                 
         # ML -> Database (metadata, feature store)
-        for ml in get_nodes_by_category("ml"):
-            for db in get_nodes_by_category("database"):
-                add_edge(ml.id, db.id)
+        connect_all("ml", "database")
         
         # Backend -> Search
-        for backend in get_nodes_by_category("backend"):
-            for search in get_nodes_by_category("search"):
-                add_edge(backend.id, search.id)
+        connect_all("backend", "search")
         
         # Search -> Database (indexing)
-        for search in get_nodes_by_category("search"):
-            for db in get_nodes_by_category("database"):
-                add_edge(search.id, db.id)
+        connect_all("search", "database")
         
         # Frontend -> Hosting (frontend hosting)
-        for frontend in get_nodes_by_category("frontend"):
-            for hosting in get_nodes_by_category("hosting"):
-                # Only connect if it's a frontend hosting service
-                if any(keyword in hosting.data.componentId for keyword in ["vercel", "netlify"]):
-                    add_edge(frontend.id, hosting.id)
+        # Only connect if it's a frontend hosting service
+        connect_all("frontend", "hosting", ["vercel", "netlify"])
         
         # Backend -> Hosting (backend hosting)
-        for backend in get_nodes_by_category("backend"):
-            for hosting in get_nodes_by_category("hosting"):
-                # Connect to backend hosting services
-                if any(keyword in hosting.data.componentId for keyword in ["railway", "render", "cloudrun", "ec2", "compute", "azure"]):
-                    add_edge(backend.id, hosting.id)
+        # Connect to backend hosting services
+        connect_all("backend", "hosting", ["railway", "render", "cloudrun", "ec2", "compute", "azure"])
         
         # CI/CD -> Backend (deployment target)
-        for cicd in get_nodes_by_category("cicd"):
-            for backend in get_nodes_by_category("backend"):
+        for cicd in nodes_in_category.get("cicd", []):
+            for backend in nodes_in_category.get("backend", []):
                 add_edge(cicd.id, backend.id)
-            for frontend in get_nodes_by_category("frontend"):
+            for frontend in nodes_in_category.get("frontend", []):
                 add_edge(cicd.id, frontend.id)
         
         # Monitoring -> Backend
-        for monitoring in get_nodes_by_category("monitoring"):
-            for backend in get_nodes_by_category("backend"):
-                add_edge(monitoring.id, backend.id)
+        connect_all("monitoring", "backend")
         
         return architecture
 
@@ -1,10 +1,84 @@
 """Gemini API service for chat completions."""
 
+import time
+import asyncio
+import threading
+from functools import lru_cache
 from google import genai
 from google.genai import types
-from typing import Optional
+from google.genai import errors as genai_errors
+from typing import AsyncIterator, Optional
 from app.config import settings
 from app.data.components_data import COMPONENT_LIBRARY
+from app.models.architecture import Scope
+
+
+def _build_component_aliases() -> tuple[tuple[str, tuple[str, ...]], ...]:
+    """
+    Build the (alias, component IDs) table for component extraction.
+    
+    An alias is a component ID or lowercased name; aliases shared by several
+    components (or a name equal to its ID) appear once, so the text is searched
+    once per distinct alias.
+    """
+    alias_ids: dict[str, list[str]] = {}
+    for category in COMPONENT_LIBRARY:
+        for comp in category.components:
+            for alias in dict.fromkeys((comp.id, comp.name.lower())):
+                alias_ids.setdefault(alias, []).append(comp.id)
+    return tuple((alias, tuple(ids)) for alias, ids in alias_ids.items())
+
+
+# Built once at import; the component library is static
+_COMPONENT_ALIASES = _build_component_aliases()
+
+
+def _is_missing_cache_error(error: Exception) -> bool:
+    """Check whether a request failed because its cached content is gone or not usable."""
+    return isinstance(error, genai_errors.ClientError) and error.code in (403, 404)
+
+
+@lru_cache(maxsize=256)
+def _render_dynamic_prompt(
+    context: Optional[str],
+    chat_width: Optional[int],
+    scope_key: Optional[tuple]
+) -> str:
+    """Render the per-turn prompt sections (memoized: scope and width rarely change)."""
+    
+    # Build scope context
+    scope_text = ""
+    if scope_key:
+        users, traffic_level, data_volume_gb, regions, availability = scope_key
+        scope_text = f"""
+Current Architecture Scope:
+- Users: {users}
+- Traffic Level: {traffic_level}/5
+- Data Volume: {data_volume_gb} GB
+- Regions: {regions}
+- Availability: {availability}%
+"""
+    
+    # Build chat width context
+    width_text = ""
+    if chat_width:
+        width_text = f"""
+UI Constraints:
+- Chat panel width: {chat_width}px
+- For complex diagrams or visualizations, suggest implementing on the canvas instead of text
+- Keep code blocks and text responses concise to fit the chat width
+- Avoid ASCII diagrams that are wider than {chat_width - 100}px
+"""
+    
+    dynamic_prompt = f"""{scope_text}
+
+{width_text}
+"""
+    
+    if context:
+        dynamic_prompt += f"\n\nRelevant Knowledge Base Context:\n{context}"
+    
+    return dynamic_prompt
 
 
 class GeminiService:
@@ -17,14 +91,23 @@ class GeminiService:
         
         self.client = genai.Client(api_key=settings.gemini_api_key)
         self.model_id = settings.gemini_model
+        
+        # The component library and base prompt never change at runtime
+        self._component_library_text = self._build_component_library_text()
+        self._base_prompt = self._build_base_prompt()
+        
+        # Server-side cache of the static system prompt (see _get_prompt_cache)
+        self._prompt_cache_name: Optional[str] = None
+        self._prompt_cache_expires_at = 0.0
+        self._prompt_cache_lock = asyncio.Lock()
     
-    def generate_response(
+    async def generate_response(
         self,
         user_message: str,
         context: Optional[str] = None,
         conversation_history: Optional[list[dict[str, str]]] = None,
         chat_width: Optional[int] = None,
-        scope: Optional[dict] = None
+        scope: Optional[Scope] = None
     ) -> str:
         """
         Generate a response using Gemini.
@@ -36,10 +119,71 @@ class GeminiService:
             chat_width: Width of chat panel in pixels
             scope: Architecture scope (users, traffic, etc.)
         """
-        # Build the prompt with system context
-        system_prompt = self._build_system_prompt(context, chat_width, scope)
+        contents = self._build_history(conversation_history)
+        
+        cached_content = await self._get_prompt_cache()
+        try:
+            config, message = self._build_request(
+                user_message, context, chat_width, scope, cached_content
+            )
+            return await self._send_message(config, contents, message)
+        except Exception as e:
+            # Only a missing/unusable cache is worth a second call; quota, server
+            # and request errors would just fail (and add load) again
+            if not cached_content or not _is_missing_cache_error(e):
+                # Fallback for error handling or debug
+                print(f"Gemini API Error: {str(e)}")
+                raise e
+            
+            # The cache was evicted or rejected server-side: drop it and retry once
+            # with the full system prompt
+            print(f"⚠️ Gemini cached-prompt request failed, retrying uncached: {str(e)}")
+            await self._drop_prompt_cache(cached_content)
+            config, message = self._build_request(user_message, context, chat_width, scope)
+            return await self._send_message(config, contents, message)
+    
+    async def stream_response(
+        self,
+        user_message: str,
+        context: Optional[str] = None,
+        conversation_history: Optional[list[dict[str, str]]] = None,
+        chat_width: Optional[int] = None,
+        scope: Optional[Scope] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream a response from Gemini, yielding text chunks as they arrive.
         
-        # Build conversation history
+        Takes the same arguments as generate_response. The concatenated chunks
+        equal the text generate_response would have returned.
+        """
+        contents = self._build_history(conversation_history)
+        
+        cached_content = await self._get_prompt_cache()
+        config, message = self._build_request(
+            user_message, context, chat_width, scope, cached_content
+        )
+        streamed_any = False
+        try:
+            async for text in self._stream_message(config, contents, message):
+                streamed_any = True
+                yield text
+        except Exception as e:
+            if not cached_content or streamed_any or not _is_missing_cache_error(e):
+                print(f"Gemini API Error: {str(e)}")
+                raise e
+            
+            # Nothing was sent to the client yet, so retry uncached like generate_response
+            print(f"⚠️ Gemini cached-prompt request failed, retrying uncached: {str(e)}")
+            await self._drop_prompt_cache(cached_content)
+            config, message = self._build_request(user_message, context, chat_width, scope)
+            async for text in self._stream_message(config, contents, message):
+                yield text
+    
+    def _build_history(
+        self,
+        conversation_history: Optional[list[dict[str, str]]] = None
+    ) -> list[types.Content]:
+        """Convert stored session messages to Gemini chat history."""
         contents = []
         if conversation_history:
             for msg in conversation_history:
@@ -48,58 +192,138 @@ class GeminiService:
                     role=role,
                     parts=[types.Part.from_text(text=msg.get("content", ""))]
                 ))
+        return contents
+    
+    async def _send_message(
+        self,
+        config: types.GenerateContentConfig,
+        history: list[types.Content],
+        message: str
+    ) -> str:
+        """Send one chat turn with the async client and return the response text."""
+        chat = self.client.aio.chats.create(
+            model=self.model_id,
+            config=config,
+            history=history
+        )
+        
+        response = await chat.send_message(message)
+        return response.text
+    
+    async def _stream_message(
+        self,
+        config: types.GenerateContentConfig,
+        history: list[types.Content],
+        message: str
+    ) -> AsyncIterator[str]:
+        """Send one chat turn with the async client and yield text chunks."""
+        chat = self.client.aio.chats.create(
+            model=self.model_id,
+            config=config,
+            history=history
+        )
+        
+        async for chunk in await chat.send_message_stream(message):
+            if chunk.text:
+                yield chunk.text
+    
+    def _build_request(
+        self,
+        user_message: str,
+        context: Optional[str] = None,
+        chat_width: Optional[int] = None,
+        scope: Optional[Scope] = None,
+        cached_content: Optional[str] = None
+    ) -> tuple[types.GenerateContentConfig, str]:
+        """Build the request config and the message to send for one turn."""
+        if not cached_content:
+            system_prompt = self._build_system_prompt(context, chat_width, scope)
+            return types.GenerateContentConfig(system_instruction=system_prompt), user_message
+        
+        # The static instructions come from the cache; only the per-turn sections
+        # (scope, UI constraints, RAG context) travel with the message
+        config = types.GenerateContentConfig(cached_content=cached_content)
+        dynamic_prompt = self._build_dynamic_prompt(context, chat_width, scope).strip()
+        if not dynamic_prompt:
+            return config, user_message
+        return config, f"{dynamic_prompt}\n\nUser message:\n{user_message}"
+    
+    async def _get_prompt_cache(self) -> Optional[str]:
+        """
+        Get the name of the cached static system prompt, creating it if needed.
+        
+        The base prompt (rules + component library) is identical on every turn, so
+        it is stored once with Gemini explicit context caching and reused until the
+        TTL runs out. Returns None when caching is disabled or unavailable, in
+        which case callers send the full system prompt.
+        """
+        if not settings.gemini_context_cache:
+            return None
+        
+        if time.monotonic() < self._prompt_cache_expires_at:
+            return self._prompt_cache_name
+        
+        # Concurrent turns would otherwise each create their own cache on expiry
+        async with self._prompt_cache_lock:
+            now = time.monotonic()
+            if now < self._prompt_cache_expires_at:
+                return self._prompt_cache_name
             
-        try:
-            chat = self.client.chats.create(
-                model=self.model_id,
-                config=types.GenerateContentConfig(
-                    system_instruction=system_prompt
-                ),
-                history=contents
-            )
+            previous_cache_name = self._prompt_cache_name
+            ttl = settings.gemini_context_cache_ttl_seconds
+            try:
+                cache = await self.client.aio.caches.create(
+                    model=self.model_id,
+                    config=types.CreateCachedContentConfig(
+                        display_name="quota-system-prompt",
+                        system_instruction=self._base_prompt,
+                        ttl=f"{ttl}s",
+                    )
+                )
+                self._prompt_cache_name = cache.name
+                # The old cache still has about a minute to live; don't pay for it
+                if previous_cache_name:
+                    await self._delete_prompt_cache(previous_cache_name)
+            except Exception as e:
+                # e.g. prompt below the model's minimum cacheable size - retry after a TTL
+                print(f"⚠️ Gemini context cache unavailable: {str(e)}")
+                self._prompt_cache_name = None
             
-            response = chat.send_message(user_message)
-            return response.text
+            # Refresh a minute before the server-side copy expires
+            self._prompt_cache_expires_at = now + max(ttl - 60, 0)
+            return self._prompt_cache_name
+    
+    async def _drop_prompt_cache(self, cache_name: str):
+        """Forget a prompt cache the API rejected, so the next turn creates a new one."""
+        async with self._prompt_cache_lock:
+            if self._prompt_cache_name == cache_name:
+                self._prompt_cache_name = None
+                self._prompt_cache_expires_at = 0.0
+        # A rejected (403) cache may still exist and be billed until it expires
+        await self._delete_prompt_cache(cache_name)
+    
+    async def _delete_prompt_cache(self, cache_name: str):
+        """Delete a server-side prompt cache; one that is already gone is fine."""
+        try:
+            await self.client.aio.caches.delete(name=cache_name)
         except Exception as e:
-            # Fallback for error handling or debug
-            print(f"Gemini API Error: {str(e)}")
-            raise e
+            if not (isinstance(e, genai_errors.ClientError) and e.code == 404):
+                print(f"⚠️ Failed to delete Gemini context cache {cache_name}: {str(e)}")
     
     def _build_system_prompt(
         self, 
         context: Optional[str] = None,
         chat_width: Optional[int] = None,
-        scope: Optional[dict] = None
+        scope: Optional[Scope] = None
     ) -> str:
         """Build the system prompt with context, component library, and constraints."""
+        return self._base_prompt + self._build_dynamic_prompt(context, chat_width, scope)
+    
+    def _build_base_prompt(self) -> str:
+        """Build the static part of the system prompt (rules + component library)."""
+        component_library_text = self._component_library_text
         
-        # Build component library listing
-        component_library_text = self._build_component_library_text()
-        
-        # Build scope context
-        scope_text = ""
-        if scope:
-            scope_text = f"""
-Current Architecture Scope:
-- Users: {scope.get('users', 'not specified')}
-- Traffic Level: {scope.get('trafficLevel', 'not specified')}/5
-- Data Volume: {scope.get('dataVolumeGB', 'not specified')} GB
-- Regions: {scope.get('regions', 1)}
-- Availability: {scope.get('availability', 99.9)}%
-"""
-        
-        # Build chat width context
-        width_text = ""
-        if chat_width:
-            width_text = f"""
-UI Constraints:
-- Chat panel width: {chat_width}px
-- For complex diagrams or visualizations, suggest implementing on the canvas instead of text
-- Keep code blocks and text responses concise to fit the chat width
-- Avoid ASCII diagrams that are wider than {chat_width - 100}px
-"""
-        
-        base_prompt = f"""You are an expert architecture advisor.
+        return f"""You are an expert architecture advisor.
 
 **Role & Persona:**
 - Target Audience: Senior/Staff Software Engineers at top tech companies.
@@ -142,17 +366,36 @@ UI Constraints:
 - If details are missing, estimate them based on context.
 - **IMPORTANT**: Provide a brief text summary of these values BEFORE the JSON block, so the user sees the confirmation. The JSON block itself will be hidden from the user.
 
-{component_library_text}
+**Canvas Components Format:**
+- When you propose components to visualize, ALSO list their IDs in the same JSON block:
+  ```json
+  {{
+    "mentioned_components": ["react", "fastapi", "postgresql"]
+  }}
+  ```
+- Use only IDs from the Component Library. The block may contain `mentioned_components`, `scope_analysis`, or both.
 
-{scope_text}
+{component_library_text}
 
-{width_text}
 """
-        
-        if context:
-            base_prompt += f"\n\nRelevant Knowledge Base Context:\n{context}"
-        
-        return base_prompt
+    
+    def _build_dynamic_prompt(
+        self,
+        context: Optional[str] = None,
+        chat_width: Optional[int] = None,
+        scope: Optional[Scope] = None
+    ) -> str:
+        """Build the per-turn part of the system prompt (scope, UI width, RAG context)."""
+        scope_key = None
+        if scope is not None:
+            scope_key = (
+                scope.users,
+                scope.trafficLevel,
+                scope.dataVolumeGB,
+                scope.regions,
+                scope.availability,
+            )
+        return _render_dynamic_prompt(context, chat_width, scope_key)
     
     def _build_component_library_text(self) -> str:
         """Build a text representation of the component library."""
@@ -173,14 +416,29 @@ UI Constraints:
         This is a simple keyword-based extraction. In production, you might use
         more sophisticated NLP or have Gemini return structured data.
         """
+        # Plain substring checks (C-level, no regex engine) over the prebuilt table
         text_lower = text.lower()
-        mentioned_ids = []
-        
-        for category in COMPONENT_LIBRARY:
-            for comp in category.components:
-                # Check if component name or ID is mentioned
-                if comp.id in text_lower or comp.name.lower() in text_lower:
-                    mentioned_ids.append(comp.id)
-        
-        return list(set(mentioned_ids))  # Remove duplicates
+        return list({
+            component_id
+            for alias, ids in _COMPONENT_ALIASES
+            if alias in text_lower
+            for component_id in ids
+        })
+
+
+# Process-wide instance, so the client's connections and the prompt cache are
+# reused across requests
+_service: Optional[GeminiService] = None
+# A sync dependency runs in the threadpool, so first requests may race to build it
+# (and each would create its own billed prompt cache)
+_service_lock = threading.Lock()
+
 
+def get_gemini_service() -> GeminiService:
+    """Get or create the shared Gemini service instance."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = GeminiService()
+    return _service
@@ -1,73 +1,157 @@
 """RAG (Retrieval-Augmented Generation) service using LangChain and FAISS."""
 
 import os
+import json
+import uuid
+import hashlib
+import shutil
+import threading
+from functools import lru_cache
 from typing import List, Optional
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from app.config import settings
 
+# Identifies how the persisted index is built; change it whenever the index type
+# or its parameters change so old indexes on disk are not reused
+_INDEX_FORMAT = "hnsw32-fp16-ip-unsplit"
+
+# Knowledge base documents, one JSON object per line
+_KNOWLEDGE_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "knowledge.jsonl")
+
+
+def _load_knowledge() -> tuple[tuple[str, str], ...]:
+    """Read the (category, content) knowledge entries."""
+    with open(_KNOWLEDGE_PATH, encoding="utf-8") as f:
+        return tuple(
+            (entry["category"], entry["content"])
+            for entry in map(json.loads, f)
+        )
+
+
+# Read once at import; the knowledge base is static
+_KB_ENTRIES = _load_knowledge()
+
+
+class _ProcessLocalEmbeddings(Embeddings):
+    """Gemini embeddings whose client is created on first use in each process.
+    
+    The client talks gRPC, and gRPC channels don't survive fork(). Keying the
+    client on the pid means a service preloaded in a gunicorn master never hands
+    its channel to the forked workers.
+    """
+    
+    def __init__(self):
+        """Defer client creation until the first embedding call."""
+        self._pid: Optional[int] = None
+        self._client: Optional[GoogleGenerativeAIEmbeddings] = None
+    
+    def _get_client(self) -> GoogleGenerativeAIEmbeddings:
+        if self._pid != os.getpid():
+            self._client = GoogleGenerativeAIEmbeddings(
+                model="models/embedding-001",
+                google_api_key=settings.gemini_api_key
+            )
+            self._pid = os.getpid()
+        return self._client
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents with this process's client."""
+        return self._get_client().embed_documents(texts)
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query with this process's client."""
+        return self._get_client().embed_query(text)
+
 
 class RAGService:
     """Service for RAG functionality with vector search."""
     
-    def __init__(self):
-        """Initialize RAG service with knowledge base."""
+    def __init__(self, build_if_missing: bool = True):
+        """Initialize RAG service with knowledge base.
+        
+        Args:
+            build_if_missing: Embed and build the index when none is persisted.
+                When False only a persisted index is loaded, which needs no API
+                calls (and leaves `vector_store` None if there is none).
+        """
         if not settings.gemini_api_key:
             raise ValueError("GEMINI_API_KEY environment variable is required")
         
-        # Initialize embeddings
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            google_api_key=settings.gemini_api_key
-        )
+        # Initialize embeddings (the client itself is created lazily per process)
+        self.embeddings = _ProcessLocalEmbeddings()
         
         # Initialize vector store
         self.vector_store: Optional[FAISS] = None
         
-        # Index persistence path
-        self.index_path = "faiss_index"
+        # Dense copy of the index for exact search on small corpora (see
+        # _prepare_exact_search); rows line up with _exact_documents
+        self._exact_matrix: Optional[np.ndarray] = None
+        self._exact_documents: List[Document] = []
+        
+        # Built indexes are persisted under here, one directory per knowledge version
+        self.cache_dir = "cache"
+        
+        # Results for recent queries; the knowledge base never changes at runtime
+        self._search = lru_cache(maxsize=settings.rag_cache_size)(self._search_uncached)
         
         # Build knowledge base
-        self._build_knowledge_base()
+        self._build_knowledge_base(build_if_missing)
     
-    def _build_knowledge_base(self):
+    def _build_knowledge_base(self, build_if_missing: bool = True):
         """Build the knowledge base from architecture documentation.
         
         Note: Checks for local index first to save API calls.
         """
+        # A repeated section would cost an extra embedding and crowd the top k
+        seen: set[str] = set()
+        documents = [
+            doc for doc in self._create_knowledge_documents()
+            if not (doc.page_content in seen or seen.add(doc.page_content))
+        ]
+        index_path = self._index_path(documents)
+        
         # Try to load existing index
-        if os.path.exists(self.index_path):
+        if os.path.exists(os.path.join(index_path, "index.faiss")):
             try:
                 self.vector_store = FAISS.load_local(
-                    self.index_path, 
+                    index_path, 
                     self.embeddings,
-                    allow_dangerous_deserialization=True
+                    allow_dangerous_deserialization=True,
+                    distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
                 )
                 print("Loaded FAISS index from disk.")
+                self._prepare_exact_search()
                 return
             except Exception as e:
                 print(f"Failed to load index: {e}, rebuilding...")
 
+        if not build_if_missing:
+            return
+        
         # If loading failed or didn't exist, rebuild
         try:
-            documents = self._create_knowledge_documents()
-            
-            # Split documents into chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
+            # Each knowledge document is a short, self-contained section, so it is
+            # embedded whole rather than split into overlapping chunks.
+            # Embed every document up front (the client batches the requests),
+            # then index the vectors directly
+            vectors = np.array(
+                self.embeddings.embed_documents([doc.page_content for doc in documents]),
+                dtype="float32"
             )
-            chunks = text_splitter.split_documents(documents)
-            
-            # Create vector store
-            self.vector_store = FAISS.from_documents(chunks, self.embeddings)
+            self.vector_store = self._create_vector_store(documents, vectors)
+            self._prepare_exact_search()
             
             # Save index to disk
-            self.vector_store.save_local(self.index_path)
+            self.vector_store.save_local(index_path)
             print("Created and saved new FAISS index.")
+            self._prune_stale_indexes(index_path)
         except Exception as e:
             error_msg = str(e)
             if "RESOURCE_EXHAUSTED" in error_msg or "quota" in error_msg.lower():
@@ -78,168 +162,92 @@ class RAGService:
                 # Re-raise other errors
                 raise
     
-    def _create_knowledge_documents(self) -> List[Document]:
-        """Create knowledge base documents about architecture components and best practices."""
-        docs = []
-        
-        # UI Constraints and Chat Width Recommendations
-        docs.append(Document(page_content="""
-        UI Constraints for Chat Responses:
-        - Typical chat panel width: 400-500px
-        - Avoid ASCII diagrams or wide code blocks that exceed chat width
-        - For complex visualizations, recommend implementing on the canvas
-        - Keep code examples concise and properly formatted
-        - Use markdown formatting for better readability in narrow spaces
-        - When users ask for diagrams, suggest using the canvas feature
-        """))
-        
-        # Canvas Implementation Guide
-        docs.append(Document(page_content="""
-        Canvas Implementation Keywords:
-        - "implement on canvas", "draw on canvas", "add to canvas"
-        - "create architecture", "design system", "build diagram"
-        - "visualize", "show me the architecture"
-        When users use these phrases, the system will automatically generate
-        the architecture diagram on the canvas using the mentioned components.
-        """))
+    def _index_path(self, documents: List[Document]) -> str:
+        """Get the persist path for an index of these documents.
         
-        # Component categories and use cases
-        docs.append(Document(page_content="""
-        Backend Frameworks:
-        - FastAPI: Modern Python framework, great for APIs, fast performance
-        - Express: Popular Node.js framework, flexible and lightweight
-        - Django: Full-featured Python framework, great for complex applications
-        - Flask: Lightweight Python framework, minimal and flexible
-        - Spring Boot: Java framework, enterprise-grade, comprehensive
-        - NestJS: TypeScript framework, scalable Node.js applications
-        - Go/Gin: High performance, concurrent processing, microservices
-        """))
-        
-        docs.append(Document(page_content="""
-        Frontend Frameworks:
-        - React: Component-based, large ecosystem, widely used
-        - Next.js: React framework with SSR, great for production apps
-        - Vue: Progressive framework, easy to learn, good performance
-        - Svelte: Compile-time framework, small bundle size
-        - Angular: Full-featured TypeScript framework, enterprise apps
-        """))
-        
-        docs.append(Document(page_content="""
-        Databases:
-        - PostgreSQL: Relational, ACID compliant, complex queries, open source
-        - MySQL: Relational, widely used, good performance
-        - MongoDB: NoSQL, document-based, flexible schema
-        - Supabase: PostgreSQL-based, includes auth and storage, great for startups
-        - Firebase: Real-time database, serverless, Google ecosystem
-        - Redis: In-memory, caching, pub/sub, fast performance
-        - DynamoDB: NoSQL, AWS managed, auto-scaling
-        """))
-        
-        docs.append(Document(page_content="""
-        Hosting Platforms:
-        - Vercel: Serverless, great for Next.js, auto-scaling, edge functions
-        - Netlify: JAMstack hosting, continuous deployment, edge network
-        - AWS EC2: Virtual servers, full control, scalable
-        - GCP Compute: Google Cloud, flexible VM instances
-        - Azure VM: Microsoft cloud, enterprise integration
-        - Railway: Simple deployment, automatic scaling, good for small projects
-        - Render: Managed hosting, easy setup, good documentation
-        - Cloud Run: Serverless containers, pay per use, Google Cloud
-        """))
-        
-        docs.append(Document(page_content="""
-        Cost Optimization Guidelines:
-        1. Use serverless hosting (Vercel, Netlify, Cloud Run) for small to medium apps - lower costs with auto-scaling
-        2. Consider open-source databases (PostgreSQL, MySQL) over managed services for cost savings
-        3. Use caching (Redis) to reduce database load and costs
-        4. Start with free tiers (Supabase, Firebase) before scaling up
-        5. Monitor costs with monitoring tools (Prometheus is free)
-        6. Use CDN (Cloudflare) for static assets to reduce bandwidth costs
-        7. Consider self-hosted solutions for high-traffic applications
-        """))
-        
-        docs.append(Document(page_content="""
-        Architecture Best Practices:
-        1. Always separate frontend and backend for scalability
-        2. Use a database for persistent data storage
-        3. Add caching layer (Redis) for high-traffic applications
-        4. Use authentication service for user management
-        5. Add monitoring for production applications
-        6. Implement CI/CD for automated deployments
-        7. Use message queues for async processing
-        8. Consider multi-region deployment for global apps
-        """))
-        
-        docs.append(Document(page_content="""
-        Common Architecture Patterns:
-        - Simple Web App: Frontend + Backend + Database + Hosting
-        - Full-Stack with Auth: Frontend + Backend + Database + Auth + Hosting
-        - High-Performance: Frontend + Backend + Database + Cache + CDN + Hosting
-        - ML/AI Application: Frontend + Backend + Database + ML Framework + Storage + Hosting
-        - Microservices: Multiple Backends + Database + Message Queue + Hosting
-        """))
-        
-        docs.append(Document(page_content="""
-        Authentication Options:
-        - Auth0: Comprehensive auth service, good for enterprise, paid
-        - Clerk: Modern auth, great UX, good developer experience
-        - Supabase Auth: Free tier, PostgreSQL integration, open source
-        - Firebase Auth: Free tier, Google ecosystem, easy integration
-        - Custom JWT: Full control, no cost, requires implementation
-        - NextAuth.js: For Next.js apps, free, open source
-        - AWS Cognito: AWS ecosystem integration, scalable
-        """))
-        
-        docs.append(Document(page_content="""
-        When to use which database:
-        - PostgreSQL: Complex queries, relational data, ACID requirements
-        - MySQL: Traditional relational needs, widely supported
-        - MongoDB: Flexible schema, JSON documents, rapid development
-        - Supabase: PostgreSQL with extras (auth, storage), startup-friendly
-        - Firebase: Real-time sync, mobile apps, serverless
-        - Redis: Caching, session storage, pub/sub messaging
-        - DynamoDB: AWS ecosystem, auto-scaling, NoSQL needs
-        """))
+        The directory name hashes the knowledge content (and index format), so an
+        edited knowledge base gets a fresh index instead of loading a stale one.
+        """
+        digest = hashlib.sha256(_INDEX_FORMAT.encode())
+        for doc in documents:
+            digest.update(b"\0")
+            digest.update(doc.page_content.encode())
+        return os.path.join(self.cache_dir, f"rag_{digest.hexdigest()}")
+    
+    def _prune_stale_indexes(self, index_path: str):
+        """Delete indexes of older knowledge versions, keeping only `index_path`."""
+        keep = os.path.basename(index_path)
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("rag_") and name != keep:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+    
+    def _create_vector_store(self, documents: List[Document], vectors: np.ndarray) -> FAISS:
+        """Build the vector store over pre-computed document embeddings.
         
-        # Component Library Scope Recommendations
-        docs.append(Document(page_content="""
-        Scope-Based Component Recommendations:
+        Uses an HNSW graph with vectors stored as float16 (half the float32 size).
+        Unlike 8-bit codes, fp16 needs no trained value ranges, so it stays exact
+        enough however few documents there are. Vectors are normalized in place
+        so the inner product is the cosine similarity. Row i of `vectors` must
+        embed `documents[i]`.
+        """
+        faiss.normalize_L2(vectors)
+        index = faiss.IndexHNSWSQ(
+            vectors.shape[1],
+            faiss.ScalarQuantizer.QT_fp16,
+            32,
+            faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = 200
+        index.add(vectors)
         
-        Small Scope (< 1000 users, low traffic):
-        - Database: Supabase (free tier), Firebase (free tier), PostgreSQL (self-hosted)
-        - Hosting: Vercel (free tier), Netlify (free tier), Railway ($5/mo)
-        - Backend: FastAPI, Express, Flask (all free, just hosting costs)
-        - Auth: Supabase Auth, Firebase Auth, NextAuth.js (all free)
+        ids = [str(uuid.uuid4()) for _ in documents]
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=InMemoryDocstore(dict(zip(ids, documents))),
+            index_to_docstore_id=dict(enumerate(ids)),
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+        )
+    
+    def _prepare_exact_search(self):
+        """Keep a dense copy of the vectors when the corpus is small enough.
         
-        Medium Scope (1000-10000 users, moderate traffic):
-        - Database: PostgreSQL (managed), MySQL, Supabase (paid tier)
-        - Hosting: Vercel (pro), Railway, Render, Cloud Run
-        - Backend: FastAPI, NestJS, Django
-        - Auth: Clerk, Auth0, Supabase Auth
-        - Cache: Redis (managed)
+        For a few dozen documents one matrix-vector product (BLAS, SIMD) is
+        cheaper than walking the HNSW graph, and it is exact. The rows are read
+        back from the index, so both paths score the same stored vectors.
+        """
+        index = self.vector_store.index
+        if index.ntotal > settings.rag_exact_search_max_docs:
+            return
         
-        Large Scope (> 10000 users, high traffic):
-        - Database: PostgreSQL (enterprise), DynamoDB, MongoDB Atlas
-        - Hosting: AWS EC2, GCP Compute, Azure VM, Cloud Run (scaled)
-        - Backend: Spring Boot, NestJS, Go/Gin (high performance)
-        - Auth: Auth0, AWS Cognito
-        - Cache: Redis (enterprise), Memcached
-        - Queue: Kafka, RabbitMQ, AWS SQS
-        - Monitoring: DataDog, New Relic, Sentry
-        """))
+        self._exact_matrix = index.reconstruct_n(0, index.ntotal)
+        self._exact_documents = [
+            self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[i])
+            for i in range(index.ntotal)
+        ]
+    
+    def _create_knowledge_documents(self) -> List[Document]:
+        """Load the knowledge base documents about architecture components and best practices.
         
-        return docs
+        The documents come from app/data/knowledge.jsonl (read at import), each
+        with a `category` (kept as metadata) and the `content` to embed.
+        """
+        return [
+            Document(page_content=content, metadata={"category": category})
+            for category, content in _KB_ENTRIES
+        ]
     
     def retrieve_context(self, query: str, top_k: Optional[int] = None) -> str:
         """
         Retrieve relevant context from knowledge base.
         
-        IMPORTANT: This method only performs vector search (no API calls).
-        All API calls happen during initialization only.
+        Each new query costs one embedding API call; repeated queries are
+        answered from an in-process LRU cache without any call.
         
         Args:
             query: User query
-            top_k: Number of documents to retrieve (defaults to config)
+            top_k: Number of documents to retrieve (defaults to config, clamped to
+                1..settings.rag_max_top_k)
             
         Returns:
             Concatenated context from retrieved documents
@@ -247,11 +255,73 @@ class RAGService:
         if not self.vector_store:
             return ""
         
-        k = top_k or settings.rag_top_k
+        k = max(1, min(top_k or settings.rag_top_k, settings.rag_max_top_k))
+        return self._search(query.strip(), k)
+    
+    def _search_uncached(self, query: str, k: int) -> str:
+        """Embed the query and join the k most similar documents."""
+        # Normalize the query like the documents, so ranking is by cosine similarity
+        query_vector = np.array([self.embeddings.embed_query(query)], dtype="float32")
+        faiss.normalize_L2(query_vector)
         
-        # Search for similar documents (vector search only - no API call)
-        docs = self.vector_store.similarity_search(query, k=k)
+        if self._exact_matrix is not None:
+            docs = self._exact_search(query_vector[0], k)
+        else:
+            # Candidate list size for the HNSW walk; must cover k to return k results
+            index = self.vector_store.index
+            if isinstance(index, faiss.IndexHNSW):
+                index.hnsw.efSearch = max(16, 2 * k)
+            
+            # Search for similar documents
+            docs = self.vector_store.similarity_search_by_vector(query_vector[0].tolist(), k=k)
         
         # Combine document contents
         context_parts = [doc.page_content for doc in docs]
         return "\n\n".join(context_parts)
+    
+    def _exact_search(self, query_vector: np.ndarray, k: int) -> List[Document]:
+        """Score every document against a normalized query and return the top k."""
+        scores = self._exact_matrix @ query_vector
+        k = min(k, len(scores))
+        # Select the top k without a full sort, then order just those
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self._exact_documents[i] for i in top]
+
+
+# Process-wide instance; see preload_rag_service for sharing it across workers
+_instance: Optional[RAGService] = None
+# Startup warm-up and request threads may race to build it
+_instance_lock = threading.Lock()
+
+
+def get_rag_service() -> RAGService:
+    """Get or create the shared RAG service instance."""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = RAGService()
+    return _instance
+
+
+def preload_rag_service() -> bool:
+    """
+    Load the persisted index before gunicorn forks its workers.
+    
+    Only the documents and the FAISS index are loaded, so forked workers share
+    them copy-on-write; each worker creates its own embeddings client on its
+    first query. Building a missing index would need embedding calls (and
+    FAISS threads) in the master, which must not run before fork; in that case
+    nothing is preloaded and the workers build the index as usual.
+    
+    Returns:
+        Whether a persisted index was preloaded
+    """
+    global _instance
+    service = RAGService(build_if_missing=False)
+    if service.vector_store is None:
+        return False
+    with _instance_lock:
+        _instance = service
+    return True
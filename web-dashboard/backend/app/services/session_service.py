@@ -0,0 +1,147 @@
+"""Chat session storage backed by Redis, with an in-memory fallback."""
+
+import json
+import uuid
+from typing import Optional
+from cachetools import TTLCache
+from app.config import settings
+from app.db.redis_cache import RedisCache
+
+
+# Rough characters-per-token ratio for English text, used to budget history
+# without a tokenizer round-trip
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a piece of text."""
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def trim_history(
+    history: list[dict[str, str]],
+    token_budget: int
+) -> list[dict[str, str]]:
+    """
+    Keep the most recent whole turns that fit in an approximate token budget.
+    
+    A turn is a user message plus the replies that follow it. Turns are dropped
+    from the oldest end, so the kept history always starts with a user message
+    and never holds a reply whose question was cut. The newest turn is always
+    kept so a follow-up ("yes, visualize it") still sees the turn it refers to.
+    """
+    turn_starts = [i for i, msg in enumerate(history) if msg.get("role") == "user"]
+    
+    cut = len(history)
+    used = 0
+    for start in reversed(turn_starts):
+        used += sum(estimate_tokens(msg.get("content", "")) for msg in history[start:cut])
+        if used > token_budget and cut < len(history):
+            break
+        cut = start
+    return history[cut:] if turn_starts else []
+
+
+class SessionService:
+    """Service for storing per-session conversation history.
+    
+    With Redis configured, each session is a capped list (`sess:<id>`) with a
+    sliding TTL, so history is shared across workers and expires on its own. A
+    marker key (`sess:<id>:live`, same TTL) records the session from creation,
+    since Redis can't hold an empty list.
+    Without Redis, sessions live in this process only (single-worker dev setups),
+    in a TTL cache that is also capped in size, so idle sessions expire the same
+    way and a flood of new sessions can't grow memory without bound.
+    """
+    
+    def __init__(self):
+        """Initialize the in-memory fallback store."""
+        self._memory: TTLCache = TTLCache(
+            maxsize=settings.session_memory_max_sessions,
+            ttl=settings.session_ttl_seconds
+        )
+    
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"sess:{session_id}"
+    
+    @staticmethod
+    def _marker_key(session_id: str) -> str:
+        return f"sess:{session_id}:live"
+    
+    def _touch(self, session_id: str) -> Optional[list[dict[str, str]]]:
+        """Get an in-memory session and restart its TTL (sliding expiry)."""
+        history = self._memory.get(session_id)
+        if history is not None:
+            self._memory[session_id] = history
+        return history
+    
+    async def exists(self, session_id: str) -> bool:
+        """Check whether a session has been stored."""
+        redis = RedisCache.get_client()
+        if redis is None:
+            return self._touch(session_id) is not None
+        return bool(await redis.exists(self._marker_key(session_id), self._key(session_id)))
+    
+    async def get_or_create(self, session_id: Optional[str]) -> str:
+        """Get existing session or create a new one."""
+        if session_id and await self.exists(session_id):
+            return session_id
+        
+        new_session_id = str(uuid.uuid4())
+        redis = RedisCache.get_client()
+        if redis is None:
+            self._memory[new_session_id] = []
+        else:
+            # Stored right away, so a just-issued ID exists on both backends
+            await redis.set(
+                self._marker_key(new_session_id), 1, ex=settings.session_ttl_seconds
+            )
+        return new_session_id
+    
+    async def get_history(
+        self,
+        session_id: str,
+        limit: Optional[int] = None
+    ) -> list[dict[str, str]]:
+        """Get the most recent messages of a session (all stored ones if no limit)."""
+        redis = RedisCache.get_client()
+        if redis is None:
+            history = self._touch(session_id) or []
+            return list(history[-limit:] if limit else history)
+        
+        start = -limit if limit else 0
+        raw_messages = await redis.lrange(self._key(session_id), start, -1)
+        return [json.loads(raw) for raw in raw_messages]
+    
+    async def get_recent_history(self, session_id: str) -> list[dict[str, str]]:
+        """Get the conversation tail that fits `chat_history_token_budget`."""
+        history = await self.get_history(session_id)
+        return trim_history(history, settings.chat_history_token_budget)
+    
+    async def append(self, session_id: str, *messages: dict[str, str]):
+        """Append messages, keeping at most `session_max_messages` per session."""
+        max_messages = settings.session_max_messages
+        redis = RedisCache.get_client()
+        if redis is None:
+            history = self._touch(session_id) or []
+            history.extend(messages)
+            del history[:-max_messages]
+            self._memory[session_id] = history
+            return
+        
+        key = self._key(session_id)
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *(json.dumps(msg) for msg in messages))
+            pipe.ltrim(key, -max_messages, -1)
+            pipe.expire(key, settings.session_ttl_seconds)
+            pipe.set(self._marker_key(session_id), 1, ex=settings.session_ttl_seconds)
+            await pipe.execute()
+    
+    async def delete(self, session_id: str):
+        """Delete a session."""
+        redis = RedisCache.get_client()
+        if redis is None:
+            self._memory.pop(session_id, None)
+            return
+        await redis.delete(self._key(session_id), self._marker_key(session_id))
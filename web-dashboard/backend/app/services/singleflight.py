@@ -0,0 +1,57 @@
+"""Coalescing of concurrent identical async calls (singleflight)."""
+
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls that share a key.
+    
+    The first caller for a key starts the call; callers that arrive while it is
+    in flight await the same result (or exception). Nothing is kept once the
+    call finishes, so this never serves stale results - it only collapses bursts.
+    
+    The call runs as its own task, so one caller being cancelled (e.g. its
+    client disconnected) doesn't fail the others. It is cancelled only once
+    every caller waiting on it is gone.
+    """
+    
+    def __init__(self):
+        """Initialize the in-flight call table."""
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self._waiters: dict[Hashable, int] = {}
+    
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run `fn()` unless a call with the same key is already in flight."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._forget(key, t))
+        
+        self._waiters[key] += 1
+        try:
+            # Shield so a caller's cancellation doesn't cancel the shared task
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._inflight.get(key) is task and self._waiters[key] == 1:
+                # Last caller gone: stop the call and let the next one start afresh
+                self._forget(key, task)
+                task.cancel()
+            raise
+        finally:
+            if key in self._waiters and self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+    
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        """Drop a finished (or abandoned) call, if it is still the registered one."""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        # Mark the outcome as retrieved even when no caller awaits it
+        if task.done() and not task.cancelled():
+            task.exception()
@@ -0,0 +1,159 @@
+"""Buffered sandbox view counts, flushed to MongoDB in bulk."""
+
+import asyncio
+import uuid
+from typing import Callable, Optional
+from pymongo import UpdateOne
+from redis.exceptions import ResponseError
+from app.config import settings
+from app.db.mongodb import get_sandboxes_collection
+from app.db.redis_cache import RedisCache
+
+
+class ViewCounter:
+    """Buffer for sandbox view increments.
+    
+    Reads bump a pending counter instead of writing to MongoDB; a background
+    task periodically adds the accumulated deltas to `views` with one
+    bulk_write. With Redis configured the pending counts are a shared hash
+    (`sbx:views`), so every worker sees them; otherwise they live in this
+    process only.
+    """
+    
+    _KEY = "sbx:views"
+    # A flush key this old can't belong to a flush that is still running
+    _STALE_FLUSH_SECONDS = 300
+    
+    def __init__(self):
+        """Initialize the in-memory fallback buffer."""
+        self._pending: dict[str, int] = {}
+        self._flush_listeners: list[Callable[[dict[str, int]], None]] = []
+    
+    def add_flush_listener(self, listener: Callable[[dict[str, int]], None]):
+        """Call `listener` with the per-sandbox views after each successful flush."""
+        self._flush_listeners.append(listener)
+    
+    async def incr(self, sandbox_id: str) -> int:
+        """Record one view and return the views not yet flushed for the sandbox."""
+        redis = RedisCache.get_client()
+        if redis is None:
+            self._pending[sandbox_id] = self._pending.get(sandbox_id, 0) + 1
+            return self._pending[sandbox_id]
+        return await redis.hincrby(self._KEY, sandbox_id, 1)
+    
+    async def flush(self) -> int:
+        """
+        Add all pending views to MongoDB.
+        
+        Returns:
+            Number of sandboxes updated
+        """
+        redis = RedisCache.get_client()
+        flush_key = None
+        if redis is None:
+            drained, self._pending = self._pending, {}
+        else:
+            # Atomically move the hash aside under a key only this flush owns,
+            # so views keep counting (and other workers' flushes don't overlap).
+            # The expiry bounds a key left behind if this worker dies mid-flush
+            flush_key = f"{self._KEY}:flush:{uuid.uuid4().hex}"
+            try:
+                async with redis.pipeline(transaction=True) as pipe:
+                    pipe.rename(self._KEY, flush_key)
+                    pipe.expire(flush_key, settings.view_flush_key_ttl_seconds)
+                    await pipe.execute()
+            except ResponseError:
+                return 0  # No views since the last flush
+            drained = {
+                sandbox_id: int(count)
+                for sandbox_id, count in (await redis.hgetall(flush_key)).items()
+            }
+        
+        if drained:
+            try:
+                await get_sandboxes_collection().bulk_write(
+                    [
+                        UpdateOne({"sandboxId": sandbox_id}, {"$inc": {"views": count}})
+                        for sandbox_id, count in drained.items()
+                    ],
+                    ordered=False
+                )
+            except BaseException:
+                # Put the counts back (also on cancellation at shutdown) so the
+                # next flush retries them
+                await self._restore(drained, flush_key)
+                raise
+            for listener in self._flush_listeners:
+                listener(drained)
+        
+        if flush_key is not None:
+            await redis.delete(flush_key)
+        return len(drained)
+    
+    async def _restore(self, drained: dict[str, int], flush_key: Optional[str]):
+        """Merge counts from a failed flush back into the pending buffer."""
+        if flush_key is None:
+            for sandbox_id, count in drained.items():
+                self._pending[sandbox_id] = self._pending.get(sandbox_id, 0) + count
+            return
+        async with RedisCache.get_client().pipeline(transaction=True) as pipe:
+            for sandbox_id, count in drained.items():
+                pipe.hincrby(self._KEY, sandbox_id, count)
+            pipe.delete(flush_key)
+            await pipe.execute()
+    
+    async def recover(self) -> int:
+        """
+        Merge views left by interrupted flushes back into the pending hash.
+        
+        A worker killed between taking the hash and deleting its flush key
+        leaves a `sbx:views:flush:*` key behind. Keys younger than
+        _STALE_FLUSH_SECONDS may belong to a flush still running in another
+        worker and are skipped. If the worker died after its bulk_write, those
+        views are counted twice; that beats losing them.
+        
+        Returns:
+            Number of leftover flush keys merged
+        """
+        redis = RedisCache.get_client()
+        if redis is None:
+            return 0
+        
+        recovered = 0
+        async for flush_key in redis.scan_iter(match=f"{self._KEY}:flush:*"):
+            ttl = await redis.ttl(flush_key)
+            if ttl >= 0 and settings.view_flush_key_ttl_seconds - ttl < self._STALE_FLUSH_SECONDS:
+                continue
+            # Claim the key under a name outside the scanned pattern, so workers
+            # starting together don't merge it twice
+            claim_key = f"{self._KEY}:recover:{uuid.uuid4().hex}"
+            try:
+                await redis.rename(flush_key, claim_key)
+            except ResponseError:
+                continue  # Another worker claimed it first
+            drained = {
+                sandbox_id: int(count)
+                for sandbox_id, count in (await redis.hgetall(claim_key)).items()
+            }
+            await self._restore(drained, claim_key)
+            recovered += 1
+        return recovered
+    
+    async def run(self):
+        """Recover interrupted flushes, then flush on a fixed interval until cancelled."""
+        try:
+            recovered = await self.recover()
+            if recovered:
+                print(f"♻️ Recovered sandbox views from {recovered} interrupted flushes")
+        except Exception as e:
+            print(f"⚠️ Failed to recover sandbox views: {str(e)}")
+        
+        while True:
+            await asyncio.sleep(settings.view_flush_interval_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Failed to flush sandbox views: {str(e)}")
+
+
+view_counter = ViewCounter()
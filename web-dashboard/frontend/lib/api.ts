@@ -180,6 +180,9 @@ export async function getSandbox(sandboxId: string): Promise<SandboxResponse> {
 
 /**
  * List public sandboxes
+ *
+ * Pass the returned `nextCursor` back as `cursor` to fetch the next page
+ * (`null` when there are no more results).
  */
 export async function listSandboxes(params?: {
     search?: string;
@@ -187,8 +190,8 @@ export async function listSandboxes(params?: {
     minCost?: number;
     maxCost?: number;
     limit?: number;
-    skip?: number;
-}): Promise<SandboxListItem[]> {
+    cursor?: string;
+}): Promise<{ sandboxes: SandboxListItem[]; nextCursor: string | null }> {
     try {
         const queryParams = new URLSearchParams();
         if (params?.search) queryParams.append("search", params.search);
@@ -196,7 +199,7 @@ export async function listSandboxes(params?: {
         if (params?.minCost !== undefined) queryParams.append("min_cost", params.minCost.toString());
         if (params?.maxCost !== undefined) queryParams.append("max_cost", params.maxCost.toString());
         if (params?.limit) queryParams.append("limit", params.limit.toString());
-        if (params?.skip) queryParams.append("skip", params.skip.toString());
+        if (params?.cursor) queryParams.append("cursor", params.cursor);
 
         const url = `${API_BASE_URL}/sandboxes${queryParams.toString() ? `?${queryParams}` : ""}`;
         const response = await fetch(url);
@@ -205,7 +208,10 @@ export async function listSandboxes(params?: {
             throw new Error(`API error: ${response.status} ${response.statusText}`);
         }
 
-        return await response.json();
+        return {
+            sandboxes: await response.json(),
+            nextCursor: response.headers.get("X-Next-Cursor"),
+        };
     } catch (error) {
         console.error("List sandboxes API error:", error);
         throw error;